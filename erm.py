@@ -642,7 +642,21 @@ def run():
     )
 
     try:
-        bot.run(bot_token)
+        if config("USE_UVLOOP", default=False, cast=bool):
+            import uvloop
+
+            # Same start-up as bot.run(), minus its logging setup (logging is
+            # already configured above), but on a uvloop event loop
+            async def runner():
+                async with bot:
+                    await bot.start(bot_token)
+
+            try:
+                uvloop.run(runner())
+            except KeyboardInterrupt:
+                pass
+        else:
+            bot.run(bot_token)
     except Exception as e:
         with push_scope() as scope:
             scope.level = "error"
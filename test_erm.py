@@ -1,3 +1,4 @@
+import asyncio
 import unittest
 from typing import Union
 from unittest.mock import MagicMock
@@ -6,6 +7,7 @@ from discord import DMChannel
 from discord.ext.commands import CheckFailure, Context, NoPrivateMessage, has_any_role
 
 from helpers import MockContext, MockRole
+from utils.mongo import WriteCoalescer
 
 
 async def has_any_role_check(ctx: Context, *roles: Union[str, int]) -> bool:
@@ -60,3 +62,75 @@ class ChecksTests(unittest.IsolatedAsyncioTestCase):
         self.ctx.channel = MagicMock(DMChannel)
         self.ctx.guild = None
         self.assertFalse(await has_no_roles_check(self.ctx))
+
+
+class FakeCollection:
+    """A stand-in for a Motor collection that records `bulk_write` calls."""
+
+    def __init__(self, full_name, error=None):
+        self.full_name = full_name
+        self.error = error
+        self.calls = []
+
+    async def bulk_write(self, operations, ordered=True):
+        self.calls.append((list(operations), ordered))
+        if self.error:
+            raise self.error
+        return len(operations)
+
+
+class WriteCoalescerTests(unittest.IsolatedAsyncioTestCase):
+    """Tests the batching behaviour of `utils.mongo.WriteCoalescer`."""
+
+    async def test_operations_are_batched_by_collection(self):
+        """Operations queued together are flushed as one `bulk_write` per collection."""
+        coalescer = WriteCoalescer(interval=0.05)
+        coalescer.start()
+        tokens, links = FakeCollection("db.tokens"), FakeCollection("db.links")
+
+        results = await asyncio.gather(
+            coalescer.enqueue(tokens, "a"),
+            coalescer.enqueue(links, "b"),
+            coalescer.enqueue(tokens, "c"),
+        )
+        await coalescer.stop()
+
+        self.assertEqual(tokens.calls, [(["a", "c"], False)])
+        self.assertEqual(links.calls, [(["b"], False)])
+        self.assertEqual(results, [2, 1, 2])
+
+    async def test_errors_reach_the_waiting_callers(self):
+        """A failed `bulk_write` raises in every caller whose operation was in it."""
+        coalescer = WriteCoalescer()
+        coalescer.start()
+        broken = FakeCollection("db.broken", error=ValueError("write failed"))
+
+        results = await asyncio.gather(
+            coalescer.enqueue(broken, "a"),
+            coalescer.enqueue(broken, "b"),
+            return_exceptions=True,
+        )
+        await coalescer.stop()
+
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+
+    async def test_stop_flushes_pending_writes(self):
+        """`stop()` writes operations still waiting out the batching interval."""
+        coalescer = WriteCoalescer(interval=60)
+        coalescer.start()
+        tokens = FakeCollection("db.tokens")
+
+        pending = [
+            asyncio.create_task(coalescer.enqueue(tokens, op)) for op in ("a", "b")
+        ]
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(coalescer.stop(), 1)
+
+        self.assertEqual(await asyncio.gather(*pending), [2, 2])
+        self.assertEqual(tokens.calls, [(["a", "b"], False)])
+
+    async def test_enqueue_fails_when_not_running(self):
+        """`enqueue` raises instead of waiting forever if the coalescer isn't running."""
+        coalescer = WriteCoalescer()
+        with self.assertRaises(RuntimeError):
+            await coalescer.enqueue(FakeCollection("db.tokens"), "a")
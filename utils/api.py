@@ -1,9 +1,12 @@
 import asyncio
-import datetime
+import logging
+import time
 import typing
+from collections import defaultdict
 
 import uvicorn
 from fastapi import FastAPI, APIRouter, Header, HTTPException, Request
+from fastapi.responses import ORJSONResponse
 from discord.ext import commands
 import discord
 from erm import Bot, management_predicate, is_staff, staff_predicate, staff_check, management_check
@@ -11,57 +14,207 @@ from typing import Annotated
 from decouple import config
 
 from pydantic import BaseModel
+from pymongo import UpdateOne
+from cachetools import TTLCache
 
 # from helpers import MockContext
+from utils.mongo import WriteCoalescer
 from utils.utils import tokenGenerator
 
 
+# Fields of an API token document that the API reads or returns
+TOKEN_PROJECTION = {"token": 1, "created_at": 1, "expires_at": 1, "link_string": 1}
+FIVEM_LINK_PROJECTION = {"steam_id": 1, "license": 1}
+
+
+def shift_type_ids(settings: dict) -> frozenset:
+    """
+    Returns the IDs of every shift type configured in a guild's settings.
+
+    :param settings: The guild's settings document.
+    :return: A frozenset of shift type IDs.
+    """
+    shift_types = settings.get("shift_types") or {}
+    # Shift types are stored as {"enabled": ..., "types": [...]} by the configuration cog
+    if isinstance(shift_types, dict):
+        shift_types = shift_types.get("types") or []
+    return frozenset(shift_type["id"] for shift_type in shift_types)
+
+
+def duty_off_pipeline(steam_id, guild_id: int, shifts_collection: str) -> list:
+    """
+    Builds an aggregation over the FiveM links collection that resolves a Steam ID
+    to its Discord ID and that user's shift in the given guild.
+
+    :param steam_id: The Steam ID of the FiveM link.
+    :param guild_id: The guild to find the shift in.
+    :param shifts_collection: The name of the shifts collection to join.
+    :return: The pipeline. Its single result has the Discord ID as `_id` and, if one exists, the shift as `shift`.
+    """
+    return [
+        {"$match": {"steam_id": steam_id}},
+        {"$limit": 1},
+        {
+            "$lookup": {
+                "from": shifts_collection,
+                "localField": "_id",
+                "foreignField": "_id",
+                "as": "shifts",
+            }
+        },
+        {
+            "$project": {
+                "shift": {
+                    "$first": {
+                        "$filter": {
+                            "input": {"$ifNull": [{"$first": "$shifts.data"}, []]},
+                            "cond": {"$eq": ["$$this.guild", guild_id]},
+                        }
+                    }
+                }
+            }
+        },
+    ]
+
+
 class Identification(BaseModel):
     license: typing.Optional[typing.Any]
     discord: typing.Optional[typing.Any]
     source: typing.Literal["fivem", "discord"]
 
 
-async def validate_authorization(bot: Bot, token: str, disable_static_tokens=False):
-    # Check static and dynamic tokens
-    if not disable_static_tokens:
-        static_token = config("API_STATIC_TOKEN")  # Dashboard
-        if token == static_token:
-            return True
-    token_obj = await bot.api_tokens.db.find_one({"token": token})
-    if token_obj:
-        if int(datetime.datetime.now().timestamp()) < token_obj["expires_at"]:
-            return True
-        else:
-            return False
-    else:
-        return False
+async def validate_and_resolve(bot: Bot, token: str, cache: typing.MutableMapping | None = None):
+    """
+    Resolves a dynamic API token to its token object and linked link string object.
+
+    Results are stored in `cache` (keyed by token) so repeat requests skip both Mongo round trips.
+
+    :param bot: The bot instance.
+    :param token: The token to resolve.
+    :param cache: An optional mapping used to cache resolved tokens.
+    :return: A tuple of (token_obj, link_string_obj), or None if the token does not exist.
+    """
+    if cache is not None and token in cache:
+        return cache[token]
+
+    token_obj = await bot.api_tokens.db.find_one({"token": token}, TOKEN_PROJECTION)
+    if not token_obj:
+        return None
+
+    link_string_obj = None
+    if token_obj.get("link_string"):
+        link_string_obj = await bot.link_strings.db.find_one(
+            {"_id": token_obj["link_string"]}, {"guild": 1}
+        )
+
+    resolved = (token_obj, link_string_obj)
+    if cache is not None:
+        cache[token] = resolved
+    return resolved
+
+
+def route(method: str, path: str):
+    """
+    Marks an APIRoutes method as an endpoint, registered on the router when APIRoutes is constructed.
+
+    :param method: The HTTP method of the endpoint.
+    :param path: The path of the endpoint.
+    """
+
+    def decorator(func):
+        func._route = (method, path)
+        return func
+
+    return decorator
 
 
 class APIRoutes:
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, coalescer: WriteCoalescer):
         self.bot = bot
+        self.coalescer = coalescer
         self.router = APIRouter()
-        for i in dir(self):
-           # # print(i)
-            if any(
-                [i.startswith(a) for a in ("GET_", "POST_", "PATCH_", "DELETE_")]
-            ) and not i.startswith("_"):
-                x = i.split("_")[0]
+        self._auth_cache: TTLCache[str, tuple[dict, dict]] = TTLCache(
+            maxsize=10_000, ttl=60
+        )
+        self._member_404: TTLCache[tuple[int, int], bool] = TTLCache(
+            maxsize=10_000, ttl=300
+        )
+        self._icon_cache: dict[int, tuple[str | None, str]] = {}
+        self._mutual_cache: TTLCache[tuple[int, ...], dict] = TTLCache(
+            maxsize=1024, ttl=30
+        )
+        self._token_locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._token_cache: dict[str, dict] = {}
+        for func in type(self).__dict__.values():
+            if hasattr(func, "_route"):
+                method, path = func._route
                 self.router.add_api_route(
-                    f"/{i.removeprefix(x+'_')}",
-                    getattr(self, i),
-                    methods=[i.split("_")[0].upper()],
+                    path, getattr(self, func.__name__), methods=[method]
                 )
 
+    async def _auth(
+        self,
+        authorization: str | None,
+        require_link_string=True,
+        detail="Invalid authorization",
+    ):
+        """
+        Validates a dynamic token and returns its token object and link string object.
+
+        :param authorization: The token passed in the Authorization header.
+        :param require_link_string: Whether the token must be linked to a link string.
+        :param detail: The error detail to use when the token is missing, invalid or expired.
+        :return: A tuple of (token_obj, link_string_obj).
+        """
+        if not authorization:
+            raise HTTPException(status_code=401, detail=detail)
+
+        resolved = await validate_and_resolve(
+            self.bot, authorization, self._auth_cache
+        )
+        if not resolved:
+            raise HTTPException(status_code=401, detail=detail)
+
+        token_obj, link_string_obj = resolved
+        if int(time.time()) > token_obj["expires_at"]:
+            raise HTTPException(status_code=401, detail=detail)
+
+        if require_link_string and not link_string_obj:
+            raise HTTPException(status_code=401, detail="Invalid link string")
+
+        return token_obj, link_string_obj
+
+    def _icon_url(self, guild: discord.Guild):
+        # Keyed by guild ID so a changed icon replaces its stale entry
+        icon_key = guild.icon.key if guild.icon else None
+        cached = self._icon_cache.get(guild.id)
+        if cached and cached[0] == icon_key:
+            return cached[1]
+
+        try:
+            icon = guild.icon.with_size(512)
+            icon = icon.with_format("png")
+            icon = str(icon)
+        except AttributeError:
+            icon = "https://cdn.discordapp.com/embed/avatars/0.png?size=512"
+
+        self._icon_cache[guild.id] = (icon_key, icon)
+        return icon
+
+    @route("GET", "/status")
     def GET_status(self):
         return {"guilds": len(self.bot.guilds), "ping": round(self.bot.latency * 1000)}
 
+    @route("POST", "/get_mutual_guilds")
     async def POST_get_mutual_guilds(self, request: Request):
         json_data = await request.json()
         guild_ids = json_data.get("guilds")
         if not guild_ids:
-            return HTTPException(status_code=400, detail="No guild ids given")
+            raise HTTPException(status_code=400, detail="No guild ids given")
+
+        key = tuple(sorted(int(i) for i in guild_ids))
+        if key in self._mutual_cache:
+            return self._mutual_cache[key]
 
         guilds = []
         for i in guild_ids:
@@ -69,134 +222,150 @@ class APIRoutes:
             if not guild:
                 continue
             if guild.get_member(self.bot.user.id):
-                try:
-                    icon = guild.icon.with_size(512)
-                    icon = icon.with_format("png")
-                    icon = str(icon)
-                except Exception as e:
-                   # # print(e)
-                    icon = "https://cdn.discordapp.com/embed/avatars/0.png?size=512"
+                icon = self._icon_url(guild)
 
                 guilds.append(
                     {"id": str(guild.id), "name": str(guild.name), "icon_url": icon}
                 )
 
-        return {"guilds": guilds}
+        self._mutual_cache[key] = {"guilds": guilds}
+        return self._mutual_cache[key]
 
 
+    async def _permission_level(self, guild: discord.Guild, member: discord.Member):
+        management, staff = await asyncio.gather(
+            management_check(self.bot, guild, member),
+            staff_check(self.bot, guild, member),
+        )
+        return 2 if management else 1 if staff else 0
+
+    @route("POST", "/get_staff_guilds")
     async def POST_get_staff_guilds(self, request: Request):
         json_data = await request.json()
         guild_ids = json_data.get("guilds")
         user_id = json_data.get("user")
         if not guild_ids:
-            return HTTPException(status_code=400, detail="No guilds specified")
+            raise HTTPException(status_code=400, detail="No guilds specified")
+
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return []
+
+        candidates = [
+            guild
+            for guild in (self.bot.get_guild(int(i)) for i in guild_ids)
+            if guild and guild.get_member(self.bot.user.id)
+        ]
+
+        members = {}
+        misses = []
+        for guild in candidates:
+            member = guild.get_member(user_id)
+            if member:
+                members[guild.id] = member
+            elif (guild.id, user_id) not in self._member_404:
+                misses.append(guild)
+
+        # Fetch every uncached member concurrently instead of one guild at a time
+        results = await asyncio.gather(
+            *(guild.fetch_member(user_id) for guild in misses), return_exceptions=True
+        )
+        for guild, result in zip(misses, results):
+            if isinstance(result, discord.NotFound):
+                self._member_404[(guild.id, user_id)] = True
+            elif not isinstance(result, BaseException):
+                members[guild.id] = result
+
+        resolved = [guild for guild in candidates if guild.id in members]
+        permission_levels = await asyncio.gather(
+            *(self._permission_level(guild, members[guild.id]) for guild in resolved)
+        )
 
         guilds = []
-        for i in guild_ids:
-            guild: discord.Guild = self.bot.get_guild(int(i))
-            if not guild:
-                continue
-            if guild.get_member(self.bot.user.id):
-                try:
-                    icon = guild.icon.with_size(512)
-                    icon = icon.with_format("png")
-                    icon = str(icon)
-                except Exception as e:
-                   # # print(e)
-                    icon = "https://cdn.discordapp.com/embed/avatars/0.png?size=512"
-
-                try:
-                    user = await guild.fetch_member(user_id)
-                except:
-                    continue
-
-                permission_level = 0
-                if await management_check(self.bot, guild, user):
-                    permission_level = 2
-                elif await staff_check(self.bot, guild, user):
-                    permission_level = 1
-                if permission_level > 0:
-                    guilds.append(
-                        {
-                            "id": str(guild.id),
-                            "name": str(guild.name),
-                            "icon_url": icon,
-                            "member_count": str(guild.member_count),
-                            "permission_level": permission_level,
-                        }
-                    )
+        for guild, permission_level in zip(resolved, permission_levels):
+            if permission_level > 0:
+                guilds.append(
+                    {
+                        "id": str(guild.id),
+                        "name": str(guild.name),
+                        "icon_url": self._icon_url(guild),
+                        "member_count": str(guild.member_count),
+                        "permission_level": permission_level,
+                    }
+                )
 
         return guilds
 
+    @route("POST", "/check_staff_level")
     async def POST_check_staff_level(self, request: Request):
         json_data = await request.json()
         guild_id = json_data.get("guild")
         user_id = json_data.get("user")
         if not guild_id or not user_id:
-            return HTTPException(status_code=400, detail="Invalid guild")
+            raise HTTPException(status_code=400, detail="Invalid guild")
 
         try:
-            guild = await self.bot.fetch_guild(guild_id)
-        except (discord.Forbidden, discord.HTTPException):
-            return HTTPException(status_code=400, detail="Invalid guild")
+            guild = self.bot.get_guild(int(guild_id)) or await self.bot.fetch_guild(
+                guild_id
+            )
+        except (ValueError, discord.Forbidden, discord.HTTPException):
+            raise HTTPException(status_code=400, detail="Invalid guild")
 
         try:
-            user = await guild.fetch_member(user_id)
-        except (discord.Forbidden, discord.HTTPException):
+            user = guild.get_member(int(user_id)) or await guild.fetch_member(user_id)
+        except (ValueError, discord.Forbidden, discord.HTTPException):
             return {"permission_level": 0}
 
-        permission_level = 0
-        if await management_check(self.bot, guild, user):
-            permission_level = 2
-        elif await staff_check(self.bot, guild, user):
-            permission_level = 1
-
+        permission_level = await self._permission_level(guild, user)
 
         return {"permission_level": permission_level}
 
+    @route("POST", "/get_guild_settings")
     async def POST_get_guild_settings(self, request: Request):
         json_data = await request.json()
         guild_id = json_data.get("guild")
         if not guild_id:
-            return HTTPException(status_code=400, detail="Invalid guild")
+            raise HTTPException(status_code=400, detail="Invalid guild")
         guild: discord.Guild = self.bot.get_guild(int(guild_id))
         settings = await self.bot.settings.find_by_id(guild.id)
         if not settings:
-            return HTTPException(status_code=400, detail="Invalid guild")
+            raise HTTPException(status_code=400, detail="Invalid guild")
 
         return settings
 
+    @route("POST", "/update_guild_settings")
     async def POST_update_guild_settings(self, request: Request):
         json_data = await request.json()
         guild_id = json_data.get("guild")
 
+        if not guild_id:
+            raise HTTPException(status_code=400, detail="Invalid guild")
+        settings = await self.bot.settings.find_by_id(int(guild_id))
+        if not settings:
+            raise HTTPException(status_code=404, detail="Guild does not have settings attribute")
+
         for key, value in json_data.items():
             if key == "guild":
                 continue
             if isinstance(value, dict):
-                settings = await self.bot.settings.find_by_id(guild_id)
-                if not settings:
-                    return HTTPException(status_code=400, detail="Invalid guild")
-                for k, v in value.items():
-                    settings[key][k] = v
-        await self.bot.settings.update_by_id(settings)
+                settings.setdefault(key, {}).update(value)
 
-        if not guild_id:
-            return HTTPException(status_code=400, detail="Invalid guild")
-        guild: discord.Guild = self.bot.get_guild(int(guild_id))
-        settings = await self.bot.settings.find_by_id(guild.id)
-        if not settings:
-            return HTTPException(status_code=404, detail="Guild does not have settings attribute")
+        await self.bot.settings.db.update_one(
+            {"_id": settings["_id"]},
+            {"$set": {k: v for k, v in settings.items() if k != "_id"}},
+        )
 
         return settings
 
 
+    @route("POST", "/get_guild_roles")
     async def POST_get_guild_roles(self, request: Request):
         json_data = await request.json()
         guild_id = json_data.get("guild")
 
         if not guild_id:
-            return HTTPException(status_code=400, detail="Invalid guild")
+            raise HTTPException(status_code=400, detail="Invalid guild")
         guild: discord.Guild = self.bot.get_guild(int(guild_id))
 
 
@@ -207,12 +376,13 @@ class APIRoutes:
             "color": role.color
         } for role in guild.roles]
 
+    @route("POST", "/get_guild_channels")
     async def POST_get_guild_channels(self, request: Request):
         json_data = await request.json()
         guild_id = json_data.get("guild")
 
         if not guild_id:
-            return HTTPException(status_code=400, detail="Invalid guild")
+            raise HTTPException(status_code=400, detail="Invalid guild")
         guild: discord.Guild = self.bot.get_guild(int(guild_id))
 
         return [{
@@ -221,11 +391,12 @@ class APIRoutes:
             "type": channel.type
         } for channel in guild.channels]
 
-    async def POST_get_last_warnings(self, request):
+    @route("POST", "/get_last_warnings")
+    async def POST_get_last_warnings(self, request: Request):
         json_data = await request.json()
         guild_id = json_data.get("guild")
         # NOTE: This API is deprecated.
-        return HTTPException(status_code=500, detail="This API is deprecated")
+        raise HTTPException(status_code=500, detail="This API is deprecated")
 
         # warning_objects = {}
         # async for document in self.bot.warnings.db.find(
@@ -237,6 +408,7 @@ class APIRoutes:
 
         # return warning_objects
 
+    @route("GET", "/get_token")
     async def GET_get_token(
         self, authorization: Annotated[str | None, Header()], request: Request
     ):
@@ -251,23 +423,47 @@ class APIRoutes:
 
         if authorization != config("API_PRIVATE_KEY"):
             raise HTTPException(status_code=401, detail="Invalid authorization")
-        has_token = await self.bot.api_tokens.find_by_id(request.client.host)
-        if has_token:
-            if not int(datetime.datetime.now().timestamp()) > has_token["expires_at"]:
-                return has_token
-       # # print(request)
-        generated = tokenGenerator()
-        object = {
-            "_id": request.client.host,
-            "token": generated,
-            "created_at": int(datetime.datetime.now().timestamp()),
-            "expires_at": int(datetime.datetime.now().timestamp()) + 2.592e6,
-        }
 
-        await self.bot.api_tokens.upsert(object)
+        now = int(time.time())
+        ip = request.client.host
+        cached = self._token_cache.get(ip)
+        if cached and now < cached["expires_at"] - 3600:
+            return cached
+
+        # Concurrent requests from the same IP wait here rather than racing to generate tokens
+        async with self._token_locks[ip]:
+            cached = self._token_cache.get(ip)
+            if cached and now < cached["expires_at"] - 3600:
+                return cached
+
+            has_token = await self.bot.api_tokens.find_by_id(ip)
+            if has_token:
+                if not now > has_token["expires_at"]:
+                    self._token_cache[ip] = has_token
+                    return has_token
+                self._auth_cache.pop(has_token["token"], None)
+           # # print(request)
+            generated = tokenGenerator()
+            object = {
+                "_id": ip,
+                "token": generated,
+                "created_at": now,
+                "expires_at": now + 2.592e6,
+            }
+
+            await self.coalescer.enqueue(
+                self.bot.api_tokens.db,
+                UpdateOne(
+                    {"_id": ip},
+                    {"$set": {k: v for k, v in object.items() if k != "_id"}},
+                    upsert=True,
+                ),
+            )
+            self._token_cache[ip] = object
 
         return object
 
+    @route("POST", "/authorize_token")
     async def POST_authorize_token(
         self,
         authorization: Annotated[str | None, Header()],
@@ -284,13 +480,11 @@ class APIRoutes:
         if not authorization:
             raise HTTPException(status_code=401, detail="Invalid authorization")
 
-        if not await validate_authorization(
-            self.bot, authorization, disable_static_tokens=True
-        ):
-            raise HTTPException(
-                status_code=401, detail="Invalid or expired authorization."
-            )
-        token_obj = await self.bot.api_tokens.db.find_one({"token": authorization})
+        token_obj, _ = await self._auth(
+            authorization,
+            require_link_string=False,
+            detail="Invalid or expired authorization.",
+        )
 
         if not x_link_string:
             raise HTTPException(status_code=401, detail="Invalid authorization")
@@ -305,13 +499,40 @@ class APIRoutes:
         link_string_obj["token"] = authorization
         link_string_obj["ip"] = token_obj["_id"]
         link_string_obj["link_string"] = link_string_obj["_id"]
-        await self.bot.link_strings.update_by_id(link_string_obj)
-
         token_obj["link_string"] = link_string_obj["_id"]
-        await self.bot.api_tokens.update_by_id(token_obj)
+        # Holding the IP's lock keeps GET_get_token from caching the pre-link token,
+        # and the caches are only dropped once the writes have landed (or failed)
+        async with self._token_locks[token_obj["_id"]]:
+            try:
+                await asyncio.gather(
+                    self.coalescer.enqueue(
+                        self.bot.link_strings.db,
+                        UpdateOne(
+                            {"_id": link_string_obj["_id"]},
+                            {
+                                "$set": {
+                                    "token": link_string_obj["token"],
+                                    "ip": link_string_obj["ip"],
+                                    "link_string": link_string_obj["link_string"],
+                                }
+                            },
+                        ),
+                    ),
+                    self.coalescer.enqueue(
+                        self.bot.api_tokens.db,
+                        UpdateOne(
+                            {"_id": token_obj["_id"]},
+                            {"$set": {"link_string": token_obj["link_string"]}},
+                        ),
+                    ),
+                )
+            finally:
+                self._token_cache.pop(token_obj["_id"], None)
+                self._auth_cache.pop(authorization, None)
 
         return link_string_obj
 
+    @route("GET", "/get_link_string")
     async def GET_get_link_string(
         self, authorization: Annotated[str | None, Header()], request: Request
     ):
@@ -329,19 +550,11 @@ class APIRoutes:
             dict: A dictionary containing information about the authorization token, such as the token string,
                   its expiration timestamp, and any other associated data.
         """
-        if not authorization:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        token_obj = await self.bot.api_tokens.db.find_one({"token": authorization})
-
-        if not token_obj:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        if int(datetime.datetime.now().timestamp()) > token_obj["expires_at"]:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
+        token_obj, _ = await self._auth(authorization, require_link_string=False)
 
         return token_obj
 
+    @route("GET", "/get_current_token")
     async def GET_get_current_token(self, request: Request):
         """
         Given the client host IP, returns a dictionary with information about the token.
@@ -357,7 +570,9 @@ class APIRoutes:
                   its expiration timestamp, and any other associated data.
         """
 
-        token_obj = await self.bot.api_tokens.db.find_one({"_id": request.client.host})
+        token_obj = await self.bot.api_tokens.db.find_one(
+            {"_id": request.client.host}, TOKEN_PROJECTION
+        )
         ## print(token_obj)
         # print(request.client.host)
         if not token_obj:
@@ -367,120 +582,83 @@ class APIRoutes:
 
         return token_obj
 
+    @route("GET", "/get_online_staff")
     async def GET_get_online_staff(
         self, authorization: Annotated[str | None, Header()], request: Request
     ):
         # Use the self.bot.shifts to get all current shifts for the guild ID associated with the link string associated with the token
-        if not authorization:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        token_obj = await self.bot.api_tokens.db.find_one({"token": authorization})
-
-        if not token_obj:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        if int(datetime.datetime.now().timestamp()) > token_obj["expires_at"]:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        link_string_obj = await self.bot.link_strings.db.find_one(
-            {"_id": token_obj["link_string"]}
-        )
-
-        if not link_string_obj:
-            raise HTTPException(status_code=401, detail="Invalid link string")
+        token_obj, link_string_obj = await self._auth(authorization)
 
         guild = self.bot.get_guild(link_string_obj["guild"])
 
         if not guild:
             raise HTTPException(status_code=404, detail="Guild not found")
 
+        shifts_docs = [
+            doc
+            async for doc in self.bot.old_shift_management.shifts.db.find(
+                {"data.guild": link_string_obj["guild"]}, {"data.$": 1}
+            )
+        ]
+        discord_ids = [doc["_id"] for doc in shifts_docs]
+        fivem_by_id = {
+            fivem_link["_id"]: fivem_link
+            async for fivem_link in self.bot.fivem_links.db.find(
+                {"_id": {"$in": discord_ids}}, {"steam_id": 1}
+            )
+        }
+
         shifts = []
-        async for doc in self.bot.shift_management.shifts.db.find(
-            {"data": {"$elemMatch": {"guild": link_string_obj["guild"]}}}
-        ):
-            item = [
-                *list(
-                    filter(
-                        lambda x: (x or {}).get("guild") == link_string_obj["guild"],
-                        doc["data"],
-                    )
-                )
-            ][0]
+        for doc in shifts_docs:
+            # The positional projection returns only the matching shift
+            item = doc["data"][0]
             item["discord"] = doc["_id"]
-            fivem_link = await self.bot.fivem_links.db.find_one(
-                {"_id": item["discord"]}
-            )
-            item["fivem"] = (fivem_link or {}).get("steam_id")
+            item["fivem"] = fivem_by_id.get(doc["_id"], {}).get("steam_id")
             shifts.append(item)
 
         return shifts
 
+    @route("POST", "/get_discord")
     async def POST_get_discord(
         self,
         authorization: Annotated[str | None, Header()],
         body: Identification,
         request: Request,
     ):
-        if not authorization:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        token_obj = await self.bot.api_tokens.db.find_one({"token": authorization})
-
-        if not token_obj:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        if int(datetime.datetime.now().timestamp()) > token_obj["expires_at"]:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        link_string_obj = await self.bot.link_strings.db.find_one(
-            {"_id": token_obj["link_string"]}
-        )
-
-        if not link_string_obj:
-            raise HTTPException(status_code=401, detail="Invalid link string")
+        token_obj, link_string_obj = await self._auth(authorization)
 
         if not body or not body.license:
             raise HTTPException(status_code=400, detail="Missing license")
 
-        fivem_link = await self.bot.fivem_links.db.find_one({"license": body.license})
+        fivem_link = await self.bot.fivem_links.db.find_one(
+            {"license": body.license}, FIVEM_LINK_PROJECTION
+        )
         return (
-            {"status": "success"}.update(fivem_link)
+            {"status": "success", **fivem_link}
             if fivem_link
             else {"status": "failed"}
         )
 
+    @route("POST", "/get_fivem")
     async def POST_get_fivem(
         self, authorization: Annotated[str | None, Header()], request: Request
     ):
-        if not authorization:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        token_obj = await self.bot.api_tokens.db.find_one({"token": authorization})
-
-        if not token_obj:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        if int(datetime.datetime.now().timestamp()) > token_obj["expires_at"]:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        link_string_obj = await self.bot.link_strings.db.find_one(
-            {"_id": token_obj["link_string"]}
-        )
-
-        if not link_string_obj:
-            raise HTTPException(status_code=401, detail="Invalid link string")
+        token_obj, link_string_obj = await self._auth(authorization)
 
         body = await request.json()
         if not body or not body.get("discord_id"):
             raise HTTPException(status_code=400, detail="Missing discord_id")
 
-        fivem_link = await self.bot.fivem_links.db.find_one({"_id": body["discord_id"]})
+        fivem_link = await self.bot.fivem_links.db.find_one(
+            {"_id": body["discord_id"]}, FIVEM_LINK_PROJECTION
+        )
         return (
-            {"status": "success"}.update(fivem_link)
+            {"status": "success", **fivem_link}
             if fivem_link
             else {"status": "failed"}
         )
 
+    @route("POST", "/duty_on")
     async def POST_duty_on(
         self,
         authorization: Annotated[str | None, Header()],
@@ -490,23 +668,7 @@ class APIRoutes:
         # print(request)
         # print(await request.json())
         # print("REQUEST ^^")
-        if not authorization:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        token_obj = await self.bot.api_tokens.db.find_one({"token": authorization})
-
-        if not token_obj:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        if int(datetime.datetime.now().timestamp()) > token_obj["expires_at"]:
-            raise HTTPException(status_code=401, detail="Invalid authorization")
-
-        link_string_obj = await self.bot.link_strings.db.find_one(
-            {"_id": token_obj["link_string"]}
-        )
-
-        if not link_string_obj:
-            raise HTTPException(status_code=401, detail="Invalid link string")
+        token_obj, link_string_obj = await self._auth(authorization)
 
         guild = self.bot.get_guild(link_string_obj["guild"])
 
@@ -523,7 +685,7 @@ class APIRoutes:
 
         # print(body)
         fivem_link = await self.bot.fivem_links.db.find_one(
-            {"steam_id": body["steam_id"]}
+            {"steam_id": body["steam_id"]}, {"_id": 1}
         )
 
         if not fivem_link:
@@ -537,21 +699,18 @@ class APIRoutes:
         except discord.NotFound:
             raise HTTPException(status_code=404, detail="Could not find Discord member")
 
-        settings = await self.bot.settings.find_by_id(guild.id)
+        settings = await self.bot.settings.db.find_one(
+            {"_id": guild.id}, {"shift_types": 1}
+        )
         if not settings:
             raise HTTPException(status_code=404, detail="Could not find settings")
 
-        if settings.get("shift_types"):
-            available_shift_types = []
-            for shift_type in settings["shift_types"]:
-                available_shift_types.append(shift_type["id"])
-
         if not body.get("shift_type"):
-            await self.bot.shift_management.add_shift_by_user(member, {"guild": guild})
+            await self.bot.old_shift_management.add_shift_by_user(member, {"guild": guild})
         else:
-            if body["shift_type"] not in available_shift_types:
+            if body["shift_type"] not in shift_type_ids(settings):
                 raise HTTPException(status_code=400, detail="Invalid shift type")
-            await self.bot.shift_management.add_shift_by_user(
+            await self.bot.old_shift_management.add_shift_by_user(
                 member, {"guild": guild, "shift_type": body["shift_type"]}
             )
 
@@ -561,93 +720,84 @@ class APIRoutes:
             "shift_type": body.get("shift_type"),
         }
 
+    @route("POST", "/duty_off")
     async def POST_duty_off(
         self, authorization: Annotated[str | None, Header()], request: Request
     ):
         if not authorization:
             raise HTTPException(status_code=401, detail="Invalid authorization")
-        
-        if not await validate_authorization(
-            self.bot, authorization, disable_static_tokens=False
-        ):
-            raise HTTPException(
-                status_code=401, detail="Invalid or expired authorization."
-            )
-
-        token_obj = await self.bot.api_tokens.db.find_one({"token": authorization})
 
-        if token_obj:
-            link_string_obj = await self.bot.link_strings.db.find_one(
-                {"_id": token_obj["link_string"]}
+        # Static (dashboard) tokens pass the guild in the body instead of a link string
+        token_obj = None
+        if authorization != config("API_STATIC_TOKEN"):
+            token_obj, link_string_obj = await self._auth(
+                authorization, detail="Invalid or expired authorization."
             )
 
-            if not link_string_obj:
-                raise HTTPException(status_code=401, detail="Invalid link string")
-
-            guild = self.bot.get_guild(link_string_obj["guild"])
-        else:
-            data = await request.json()
-            guild = data['guild']
-
-        if not guild:
-            raise HTTPException(status_code=404, detail="Guild not found")
-
         body = await request.json()
 
         if not body:
             raise HTTPException(status_code=400, detail="No body provided")
 
         if token_obj:
-            if not body.get("steam_id"):
-                raise HTTPException(status_code=400, detail="No steam ID provided")
+            guild = self.bot.get_guild(link_string_obj["guild"])
+        else:
+            guild = self.bot.get_guild(int(body.get("guild") or 0))
 
-            fivem_link = await self.bot.fivem_links.db.find_one(
-                {"steam_id": body["steam_id"]}
-            )
+        if not guild:
+            raise HTTPException(status_code=404, detail="Guild not found")
 
-            if not fivem_link:
-                raise HTTPException(status_code=404, detail="Could not find FiveM link")
+        if not body.get("steam_id"):
+            raise HTTPException(status_code=400, detail="No steam ID provided")
 
-            if not fivem_link.get("_id"):
-                raise HTTPException(status_code=404, detail="Could not find FiveM link")
+        pipeline = duty_off_pipeline(
+            body["steam_id"], guild.id, self.bot.old_shift_management.shifts.db.name
+        )
+        results, settings = await asyncio.gather(
+            self.bot.fivem_links.db.aggregate(pipeline).to_list(1),
+            self.bot.settings.db.find_one({"_id": guild.id}, {"_id": 1}),
+        )
+
+        if not results or not results[0].get("_id"):
+            raise HTTPException(status_code=404, detail="Could not find FiveM link")
+        fivem_link = results[0]
 
         try:
             member = await guild.fetch_member(fivem_link["_id"])
         except discord.NotFound:
             raise HTTPException(status_code=404, detail="Could not find Discord member")
 
-        settings = await self.bot.settings.find_by_id(guild.id)
         if not settings:
             raise HTTPException(status_code=404, detail="Could not find settings")
 
-        shifts = await self.bot.shift_management.shifts.find_by_id(member.id)
-        if not shifts:
-            raise HTTPException(status_code=404, detail="Could not find user shifts")
-
-        associated_shift = list(
-            filter(lambda x: (x or {}).get("guild") == guild.id, shifts["data"])
-        )
-        if not associated_shift or len(associated_shift) == 0:
+        associated_shift = fivem_link.get("shift")
+        if not associated_shift:
             raise HTTPException(status_code=404, detail="Could not find user shifts")
-        else:
-            associated_shift = associated_shift[0]
 
-        await self.bot.shift_management.remove_shift_by_user(
+        await self.bot.old_shift_management.remove_shift_by_user(
             member, {"guild": guild, "shift": associated_shift}
         )
 
 
 
-api = FastAPI()
+api = FastAPI(default_response_class=ORJSONResponse)
 
 
 class ServerAPI(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.coalescer = WriteCoalescer()
 
     async def start_server(self):
-        api.include_router(APIRoutes(self.bot).router)
-        self.config = uvicorn.Config("utils.api:api", port=5000, log_level="info", host="0.0.0.0")
+        api.include_router(APIRoutes(self.bot, self.coalescer).router)
+        self.config = uvicorn.Config(
+            "utils.api:api",
+            port=5000,
+            host="0.0.0.0",
+            http="httptools",
+            log_level="warning",
+            access_log=False,
+        )
         self.server = uvicorn.Server(self.config)
         await self.server.serve()
 
@@ -655,6 +805,11 @@ class ServerAPI(commands.Cog):
         await self.server.shutdown()
 
     async def cog_load(self) -> None:
+        try:
+            await self.bot.old_shift_management.shifts.db.create_index("data.guild")
+        except Exception as e:
+            logging.error("Failed to create the data.guild shifts index.", exc_info=e)
+        self.coalescer.start()
         # asyncio.run_coroutine_threadsafe(self.start_server(), self.bot.loop)
         try:
             await self.start_server()
@@ -663,6 +818,7 @@ class ServerAPI(commands.Cog):
             pass
     async def cog_unload(self) -> None:
         await self.stop_server()
+        await self.coalescer.stop()
 
 
 async def setup(bot):
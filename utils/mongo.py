@@ -1,3 +1,4 @@
+import asyncio
 import collections
 import logging
 
@@ -176,3 +177,123 @@ class Document:
         within other methods which require the actual data
         """
         return await self.db.find_one({"_id": id})
+
+
+class WriteCoalescer:
+    def __init__(self, interval=0.02, max_batch=128):
+        """
+        Queues write operations and flushes them in batches with bulk_write
+        Params:
+         - interval (float) : How long to wait for more writes before flushing, in seconds
+         - max_batch (int) : The most operations to flush at once
+        """
+        self.interval = interval
+        self.max_batch = max_batch
+        self.logger = logging.getLogger(__name__)
+        self._queue = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        """
+        Starts the background flush task
+        """
+        if self._task is None or self._task.done():
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the background flush task once it has flushed its current batch,
+        then flushes anything still queued
+        """
+        if self._task is not None:
+            self._stopping.set()
+            # Wakes the flush task if it is waiting on an empty queue
+            self._queue.put_nowait(None)
+            try:
+                await self._task
+            finally:
+                self._task = None
+
+        batch = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                batch.append(item)
+        if batch:
+            await self._flush(batch)
+
+    async def enqueue(self, collection, operation):
+        """
+        Queues a write and waits until the batch containing it is written
+        Params:
+         - collection (Motor Collection) : The collection to write to
+         - operation (pymongo write operation) : e.g. UpdateOne, InsertOne
+        Returns:
+         - The BulkWriteResult of the batch the operation was flushed in
+        """
+        if self._task is None or self._task.done() or self._stopping.is_set():
+            raise RuntimeError("WriteCoalescer is not running.")
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((collection, operation, future))
+        return await future
+
+    # <-- Private methods -->
+    def __drain(self, batch):
+        """
+        Moves queued operations into `batch` without waiting
+        Returns:
+         - True if the stop signal was reached
+        """
+        while len(batch) < self.max_batch and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is None:
+                return True
+            batch.append(item)
+        return False
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            stopping = item is None
+            batch = [] if stopping else [item]
+
+            if not stopping:
+                stopping = self.__drain(batch)
+            if not stopping and len(batch) < self.max_batch:
+                # Collect more writes until the interval passes or stop() is called
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                stopping = self.__drain(batch)
+
+            if batch:
+                await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch):
+        grouped = {}
+        for collection, operation, future in batch:
+            entry = grouped.setdefault(collection.full_name, (collection, [], []))
+            entry[1].append(operation)
+            entry[2].append(future)
+
+        for collection, operations, futures in grouped.values():
+            try:
+                result = await collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                self.logger.error(
+                    f"Failed to flush {len(operations)} writes to {collection.full_name}",
+                    exc_info=e,
+                )
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future in futures:
+                    if not future.done():
+                        future.set_result(result)
@@ -1,4 +1,4 @@
-from typing import Callable, List, Optional
+from typing import Callable, Dict, List, Optional
 
 import discord
 
@@ -92,16 +92,22 @@ class StaticPaginator(Paginator):
         self.line_limit = line_limit
         self.base_embed = base_embed or discord.Embed()
 
-        import math
+        n: int = self.line_limit  # type: ignore
+        self._page_text: List[str] = [
+            "\n".join(lines[i : i + n]) for i in range(0, len(lines), n)
+        ]
+        self._embed_cache: Dict[int, List[discord.Embed]] = {}
 
-        pages: int = math.ceil(len(lines) / self.line_limit)  # type: ignore
+        pages: int = len(self._page_text)
 
         def callback(page: int) -> List[discord.Embed]:
-            m = (page - 1) * self.line_limit  # type: ignore
-            n = page * self.line_limit  # type: ignore
-
-            emb = self.base_embed.copy()
-            emb.description = "\n".join(self.lines[m:n])
-            return [emb]
+            if page not in self._embed_cache:
+                emb = self.base_embed.copy()
+                emb.description = (
+                    self._page_text[page - 1] if 0 < page <= pages else ""
+                )
+                self._embed_cache[page] = [emb]
+            # Copies, so a caller editing the page can't change later visits
+            return [emb.copy() for emb in self._embed_cache[page]]
 
         super().__init__(callback, pages, **kwargs)
@@ -1,4 +1,5 @@
 import datetime
+import secrets
 import typing
 
 import aiohttp
@@ -9,12 +10,10 @@ from discord.ext import commands
 from snowflake import SnowflakeGenerator
 from zuid import ZUID
 
-tokenGenerator = ZUID(
-    prefix="",
-    length=64,
-    timestamped=True,
-    charset="0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_",
-)
+def tokenGenerator() -> str:
+    # 48 random bytes encode to a 64 character URL-safe token
+    return secrets.token_urlsafe(48)
+
 
 generator = SnowflakeGenerator(192)
 error_gen = ZUID(prefix="error_", length=10)